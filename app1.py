@@ -1,5 +1,7 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import polars as pl
 import re
 from io import BytesIO
 
@@ -10,27 +12,171 @@ st.set_page_config(page_title="RIS Analysis Tool", page_icon="📊", layout="wid
 st.title("📊 RIS (Regional Inventory Storage) Analysis Tool")
 st.markdown("Upload your Excel files to analyze RIS vs Non-RIS distribution by brand and state.")
 
+# Style for subtotal rows in Excel exports
+TOTAL_ROW_FORMAT = {'bold': True, 'bg_color': '#E0E0E0'}
+
+# Fixed RIS status levels, so pivots always carry both columns in this order
+RIS_DTYPE = pd.CategoricalDtype(["Non RIS", "RIS"], ordered=True)
+
+# Local FC mapping based on table
+LOCAL_MAP = {
+    "DED3": ["DEL4", "DEL5", "DED4"],
+    "DED5": ["DEL4", "DEL5", "DED4"],
+    "ISK3": ["BOM5", "BOM7", "PNQ3"],
+    "BLR4": ["BLR7", "BLR8"]
+}
+
+# (receive centre, local FC) pairs flagged as RIS
+LOCAL_PAIRS = pd.MultiIndex.from_tuples([(rc, fc) for rc, fcs in LOCAL_MAP.items() for fc in fcs])
+
+# Patterns used by normalize_text_series
+_PUNCT = re.compile(r"[^\w\s]")
+_WS = re.compile(r"\s+")
+
+# Translate table deleting spaces, tabs, line breaks and NBSP in one pass
+_NO_SPACES = str.maketrans("", "", " \t\n\r\xa0")
+
 # Helper functions
 def normalize(s):
     """Normalize column for joining"""
-    return s.astype(str).str.strip().str.upper().replace({"": pd.NA})
+    return s.astype("string").str.strip().str.upper().replace({"": pd.NA})
+
+def normalize_text_series(s):
+    """Normalize text column: replace NBSP, lowercase, remove punctuation, remove spaces"""
+    return (
+        s.astype(str)
+        .str.replace("\xa0", " ", regex=False)
+        .str.lower()
+        .str.replace(_PUNCT, "", regex=True)   # remove punctuation
+        .str.replace(_WS, "", regex=True)
+    )
+
+def pivot_quantities(df, status_col):
+    """Sum quantity-shipped by Brand → fulfillment state → ship state, one column per status"""
+    index = ["Brand", "fulfillment_state", "ship-state"]
+    keys = index + [status_col]
+    qty = pl.col("quantity-shipped")
+    # Widen integer quantities so the sum cannot overflow; floats are summed as is
+    if pd.api.types.is_integer_dtype(df["quantity-shipped"]):
+        qty = qty.cast(pl.Int64)
+    pivot = (
+        pl.from_pandas(df[keys + ["quantity-shipped"]])
+        .with_columns(pl.col(keys).cast(pl.String))
+        .drop_nulls(keys)
+        .group_by(keys)
+        .agg(qty.sum())
+        .pivot(on=status_col, index=index, values="quantity-shipped")
+        .fill_null(0)
+        .sort(index)
+        .to_pandas()
+        .set_index(index)
+    )
+    return pivot.reindex(columns=pd.Index(df[status_col].cat.categories, name=status_col), fill_value=0)
+
+def add_subtotals(pivot):
+    """Insert fulfillment-state and brand subtotal rows after the rows they sum"""
+    state_totals = pivot.groupby(level=[0, 1], observed=True).sum()
+    brand_totals = pivot.groupby(level=0, observed=True).sum()
+    
+    detail_brands = pivot.index.get_level_values(0)
+    detail_states = pivot.index.get_level_values(1)
+    state_brands = state_totals.index.get_level_values(0)
+    state_states = state_totals.index.get_level_values(1)
+    
+    # Sort keys: brand, then fulfillment state (brand total last), then detail rows before their total
+    n_detail, n_state, n_brand = len(pivot), len(state_totals), len(brand_totals)
+    brand_key = np.concatenate([
+        brand_totals.index.get_indexer(detail_brands),
+        brand_totals.index.get_indexer(state_brands),
+        np.arange(n_brand)
+    ])
+    state_key = np.concatenate([
+        state_totals.index.get_indexer(pivot.index.droplevel(2)),
+        np.arange(n_state),
+        np.full(n_brand, n_state)
+    ])
+    total_key = np.concatenate([np.zeros(n_detail), np.ones(n_state + n_brand)])
+    order = np.lexsort((total_key, state_key, brand_key))
+    
+    brand_names = brand_totals.index.astype(str).to_numpy(dtype=object)
+    index = pd.MultiIndex.from_arrays([
+        np.concatenate([
+            detail_brands.astype(str).to_numpy(dtype=object),
+            state_brands.astype(str).to_numpy(dtype=object),
+            brand_names
+        ])[order],
+        np.concatenate([
+            detail_states.astype(str).to_numpy(dtype=object),
+            (state_states.astype(str) + " Total").to_numpy(dtype=object),
+            brand_names + " Total"
+        ])[order],
+        np.concatenate([
+            pivot.index.get_level_values(2).astype(str).to_numpy(dtype=object),
+            np.full(n_state + n_brand, "", dtype=object)
+        ])[order]
+    ])
+    
+    with_totals = pd.concat([pivot, state_totals, brand_totals], ignore_index=True).iloc[order]
+    with_totals.index = index
+    return with_totals
 
-def normalize_text(s):
-    """Normalize text: replace NBSP, remove punctuation, collapse spaces, lowercase, remove spaces."""
-    if pd.isna(s):
-        return ""
-    s = str(s).replace("\xa0", " ")
-    s = s.lower().strip()
-    s = re.sub(r"[^\w\s]", "", s)   # remove punctuation
-    s = re.sub(r"\s+", " ", s).strip()
-    return s.replace(" ", "")
+@st.cache_data(show_spinner=False)
+def build_report(sheets):
+    """Write [(sheet name, DataFrame, is_pivot), ...] to Excel workbook bytes.
+    
+    Pivot sheets keep their index and get their total rows highlighted; other
+    sheets are written flat and unstyled. Cached on the DataFrames' contents,
+    so reruns reuse the built workbook.
+    """
+    output = BytesIO()
+    with pd.ExcelWriter(
+        output,
+        engine='xlsxwriter',
+        engine_kwargs={'options': {'strings_to_urls': False}}
+    ) as writer:
+        total_fmt = writer.book.add_format(TOTAL_ROW_FORMAT)
+        for sheet_name, df, is_pivot in sheets:
+            if not is_pivot:
+                df.to_excel(writer, sheet_name=sheet_name, index=False)
+                continue
+            
+            df.to_excel(writer, sheet_name=sheet_name)
+            if not isinstance(df.index, pd.MultiIndex):
+                continue
+            
+            # Subtotal rows carry "Total" in the fulfillment state level
+            worksheet = writer.sheets[sheet_name]
+            first_row = df.columns.nlevels + (1 if any(df.index.names) else 0)
+            is_total = df.index.get_level_values(1).astype(str).str.contains("Total", regex=False)
+            for i in np.flatnonzero(is_total):
+                worksheet.set_row(first_row + i, None, total_fmt)
+                # Index cells carry pandas' header format, which overrides the row format,
+                # so rewrite them. Labels inside a merged span stay blank, as pandas wrote them.
+                for level in range(df.index.nlevels):
+                    if i == 0 or df.index[i][:level + 1] != df.index[i - 1][:level + 1]:
+                        worksheet.write(first_row + i, level, df.index[i][level], total_fmt)
+                    else:
+                        worksheet.write_blank(first_row + i, level, None, total_fmt)
+    return output.getvalue()
 
-def safe_correct(raw, canon_map):
-    """Replace with canonical state name if exact match exists"""
-    norm = normalize_text(raw)
-    if norm in canon_map:
-        return canon_map[norm]
-    return raw
+@st.cache_data(show_spinner=False)
+def load_excel(bytes_data):
+    """Read an uploaded workbook, cached on its contents across reruns"""
+    try:
+        return pd.read_excel(BytesIO(bytes_data), engine="calamine", dtype_backend="pyarrow")
+    except ImportError:
+        # python-calamine not installed
+        return pd.read_excel(BytesIO(bytes_data), engine="openpyxl", dtype_backend="pyarrow")
+
+@st.cache_data(show_spinner=False)
+def build_canon_map(fc_bytes):
+    """Map normalized FC state names to their canonical spelling, cached on the FC file contents"""
+    FC = load_excel(fc_bytes)
+    fc_states = FC["State"].dropna().astype(str).str.strip()
+    canon_map = pd.Series(fc_states.values, index=normalize_text_series(fc_states).values)
+    canon_map = canon_map[canon_map.index != ""]
+    # Later spellings win, as with a dict
+    return canon_map[~canon_map.index.duplicated(keep="last")]
 
 # File uploaders
 st.sidebar.header("📁 Upload Files")
@@ -42,9 +188,9 @@ if original_file and fc_file and pm_file:
     try:
         # Load data
         with st.spinner("Loading data..."):
-            Working = pd.read_excel(original_file)
-            FC = pd.read_excel(fc_file)
-            PM = pd.read_excel(pm_file)
+            Working = load_excel(original_file.getvalue())
+            FC = load_excel(fc_file.getvalue())
+            PM = load_excel(pm_file.getvalue())
         
         st.success("✅ All files loaded successfully!")
         
@@ -57,6 +203,9 @@ if original_file and fc_file and pm_file:
         with col3:
             st.metric("PM Records", len(PM))
         
+        # Identifies the current uploads, so stale results are not shown
+        upload_ids = (original_file.file_id, fc_file.file_id, pm_file.file_id)
+        
         # Process button
         if st.button("🔄 Process Data", type="primary"):
             with st.spinner("Processing data..."):
@@ -74,53 +223,57 @@ if original_file and fc_file and pm_file:
                     st.error(f"FC file missing columns: {missing}")
                     st.stop()
                 
+                # Compact dtypes: int32 quantities, Arrow-backed strings for keys.
+                # Fractional quantities are left as they are so totals stay exact.
+                if "quantity-shipped" in Working.columns:
+                    qty = Working["quantity-shipped"].fillna(0)
+                    if (
+                        pd.api.types.is_numeric_dtype(qty)
+                        and (qty == qty.round()).all()
+                        and qty.abs().max() < 2**31
+                    ):
+                        Working["quantity-shipped"] = qty.astype("int32")
+                for c in ("ship-state", "fulfillment-center-id", "sku"):
+                    if c in Working.columns:
+                        Working[c] = Working[c].astype("string[pyarrow]")
+                
                 # Create FC lookup
                 FC_lookup = FC[["FC", "State", "Cluster"]].copy()
                 FC_lookup.columns = ["lookup_key", "fulfillment_state", "cluster"]
                 
-                # Create temporary join keys
-                Working["_join"] = normalize(Working[key_col_name])
-                FC_lookup["_join"] = normalize(FC_lookup["lookup_key"])
+                # Normalized FC key, shared by the FC merge and the IXD lookup.
+                # Both sides use the same categories so the merge runs on integer codes.
+                work_fc = normalize(Working[key_col_name])
+                lookup_fc = normalize(FC_lookup["lookup_key"])
+                fc_dtype = pd.CategoricalDtype(pd.concat([work_fc, lookup_fc]).dropna().unique())
+                Working["_fc_norm"] = work_fc.astype(fc_dtype)
+                FC_lookup["_fc_norm"] = lookup_fc.astype(fc_dtype)
                 
-                # Merge
-                Working = Working.merge(
-                    FC_lookup[["_join", "fulfillment_state", "cluster"]],
-                    how="left",
-                    left_on="_join",
-                    right_on="_join"
-                )
-                
-                # Drop helper columns
-                Working.drop(columns=["_join"], inplace=True)
+                # Join on the indexed lookup
+                fc_idx = FC_lookup.set_index("_fc_norm")[["fulfillment_state", "cluster"]]
+                Working = Working.join(fc_idx, on="_fc_norm")
                 
                 # Step 2: Normalize ship-state
-                fc_states = FC["State"].dropna().astype(str).str.strip().tolist()
-                canon_map = { 
-                    normalize_text(s): s.strip() 
-                    for s in fc_states
-                    if normalize_text(s) != ""
-                }
+                canon_map = build_canon_map(fc_file.getvalue())
                 
                 # Backup original
                 if "ship-state_original" not in Working.columns:
                     Working["ship-state_original"] = Working["ship-state"]
                 
                 # Correct state names
-                Working["ship-state"] = Working["ship-state_original"].apply(
-                    lambda x: safe_correct(x, canon_map)
+                Working["ship-state"] = normalize_text_series(Working["ship-state_original"]).map(canon_map).fillna(
+                    Working["ship-state_original"]
                 )
                 
                 # Step 3: Create RIS Status
-                Working["RIS Status"] = Working.apply(
-                    lambda row: "RIS" if str(row["ship-state_original"]).strip().replace(" ", "") ==
-                                          str(row["fulfillment_state"]).strip().replace(" ", "")
-                                else "Non RIS",
-                    axis=1
-                )
+                ship = Working["ship-state_original"].fillna("").astype(str).str.translate(_NO_SPACES)
+                ff = Working["fulfillment_state"].fillna("").astype(str).str.translate(_NO_SPACES)
+                Working["RIS Status"] = pd.Categorical(np.where(ship.values == ff.values, "RIS", "Non RIS"), dtype=RIS_DTYPE)
                 
                 # Step 4: Merge PM data (Brand)
                 PM_lookup = PM.iloc[:, 2:7].copy()
                 PM_lookup.columns = ["lookup_key", "col2", "col3", "col4", "Brand"]
+                PM_lookup["lookup_key"] = PM_lookup["lookup_key"].astype("string[pyarrow]")
                 
                 # Assuming 'sku' is the key column - adjust if needed
                 lookup_key_col = "sku"
@@ -133,130 +286,54 @@ if original_file and fc_file and pm_file:
                     )
                     Working.drop(columns=["lookup_key"], inplace=True)
                 
+                # Categorical Brand lets the brand summaries group on integer codes
+                Working["Brand"] = Working["Brand"].astype("category")
+                
                 # Step 5: Create detailed pivot table with subtotals
                 # First create the main pivot
-                detailed_pivot = pd.pivot_table(
-                    Working,
-                    values="quantity-shipped",
-                    index=["Brand", "fulfillment_state", "ship-state"],
-                    columns="RIS Status",
-                    aggfunc="sum",
-                    fill_value=0
-                )
+                detailed_pivot = pivot_quantities(Working, "RIS Status")
                 
                 # Add Grand Total column
                 detailed_pivot["Grand Total"] = detailed_pivot.sum(axis=1)
                 
-                # Create brand totals
-                brand_totals = detailed_pivot.groupby(level=0).sum()
-                brand_totals.index = [(brand, f"{brand} Total", "") for brand in brand_totals.index]
-                
-                # Create fulfillment state totals
-                state_totals = detailed_pivot.groupby(level=[0, 1]).sum()
-                state_totals.index = [(brand, f"{state} Total", "") for brand, state in state_totals.index]
-                
-                # Combine all data
-                detailed_pivot_with_totals = pd.concat([detailed_pivot, state_totals, brand_totals])
-                detailed_pivot_with_totals = detailed_pivot_with_totals.sort_index()
+                # Add fulfillment state and brand totals
+                detailed_pivot_with_totals = add_subtotals(detailed_pivot)
                 
                 # Add overall grand total
-                grand_total = detailed_pivot.sum()
-                grand_total.name = ("Grand Total", "", "")
-                detailed_pivot_with_totals = pd.concat([
-                    detailed_pivot_with_totals, 
-                    pd.DataFrame([grand_total], index=[("Grand Total", "", "")])
-                ])
+                detailed_pivot_with_totals.loc[("Grand Total", "", "")] = detailed_pivot.sum().values
                 
                 # Step 6: Amazon Inventory Placement Program Analysis
-                # Local FC mapping based on table
-                LOCAL_MAP = {
-                    "DED3": ["DEL4", "DEL5", "DED4"],
-                    "DED5": ["DEL4", "DEL5", "DED4"],
-                    "ISK3": ["BOM5", "BOM7", "PNQ3"],
-                    "BLR4": ["BLR7", "BLR8"]
-                }
-                
-                def ris_status_from_ixd(row):
-                    rc = row.get("Inferred_Receive_Centre")
-                    fc = str(row.get("fulfillment-center-id", "")).strip().upper()
-                    if pd.isna(rc) or rc not in LOCAL_MAP:
-                        return "Non RIS"
-                    # If fulfillment center in LOCAL list → RIS
-                    if fc in LOCAL_MAP[rc]:
-                        return "RIS"
-                    else:
-                        return "Non RIS"
+                if "Inferred_Receive_Centre" in Working.columns:
+                    ixd_keys = pd.MultiIndex.from_arrays([Working["Inferred_Receive_Centre"], Working["_fc_norm"]])
+                    Working["RIS_by_Table"] = np.where(ixd_keys.isin(LOCAL_PAIRS), "RIS", "Non RIS")
+                else:
+                    Working["RIS_by_Table"] = "Non RIS"
+                Working["RIS_by_Table"] = Working["RIS_by_Table"].astype(RIS_DTYPE)
                 
-                Working["RIS_by_Table"] = Working.apply(ris_status_from_ixd, axis=1)
+                # Drop helper columns
+                Working.drop(columns=["_fc_norm"], inplace=True)
                 
                 # Create inventory placement pivot with subtotals
-                inventory_pivot = pd.pivot_table(
-                    Working,
-                    values="quantity-shipped",
-                    index=["Brand", "fulfillment_state", "ship-state"],
-                    columns="RIS_by_Table",
-                    aggfunc="sum",
-                    fill_value=0
-                )
-                
-                # Ensure both RIS and Non RIS columns exist
-                if "RIS" not in inventory_pivot.columns:
-                    inventory_pivot["RIS"] = 0
-                if "Non RIS" not in inventory_pivot.columns:
-                    inventory_pivot["Non RIS"] = 0
-                
-                # Reorder columns to have Non RIS, RIS
-                column_order = ["Non RIS", "RIS"]
-                inventory_pivot = inventory_pivot[[col for col in column_order if col in inventory_pivot.columns]]
+                inventory_pivot = pivot_quantities(Working, "RIS_by_Table")
                 
                 # Add Grand Total column
                 inventory_pivot["Grand Total"] = inventory_pivot.sum(axis=1)
                 
-                # Create brand totals
-                inv_brand_totals = inventory_pivot.groupby(level=0).sum()
-                inv_brand_totals.index = [(brand, f"{brand} Total", "") for brand in inv_brand_totals.index]
-                
-                # Create fulfillment state totals
-                inv_state_totals = inventory_pivot.groupby(level=[0, 1]).sum()
-                inv_state_totals.index = [(brand, f"{state} Total", "") for brand, state in inv_state_totals.index]
-                
-                # Combine all data
-                inventory_pivot_with_totals = pd.concat([inventory_pivot, inv_state_totals, inv_brand_totals])
-                inventory_pivot_with_totals = inventory_pivot_with_totals.sort_index()
+                # Add fulfillment state and brand totals
+                inventory_pivot_with_totals = add_subtotals(inventory_pivot)
                 
                 # Add overall grand total
-                inv_grand_total = inventory_pivot.sum()
-                inv_grand_total.name = ("Grand Total", "", "")
-                inventory_pivot_with_totals = pd.concat([
-                    inventory_pivot_with_totals, 
-                    pd.DataFrame([inv_grand_total], index=[("Grand Total", "", "")])
-                ])
+                inventory_pivot_with_totals.loc[("Grand Total", "", "")] = inventory_pivot.sum().values
                 
                 # Brand-level summary for inventory placement
-                inventory_brand_summary = pd.pivot_table(
-                    Working,
-                    values="quantity-shipped",
-                    index=["Brand"],
-                    columns="RIS_by_Table",
-                    aggfunc="sum",
-                    fill_value=0,
-                    margins=True,
-                    margins_name="Grand Total"
+                inventory_brand_summary = (
+                    Working.groupby(["Brand", "RIS_by_Table"], observed=True)
+                    ["quantity-shipped"].sum()
+                    .unstack("RIS_by_Table", fill_value=0)
+                    .reindex(columns=pd.Index(RIS_DTYPE.categories, name="RIS_by_Table"), fill_value=0)
                 )
-                
-                # Ensure both columns exist before calculating percentages
-                if "RIS" not in inventory_brand_summary.columns:
-                    inventory_brand_summary["RIS"] = 0
-                if "Non RIS" not in inventory_brand_summary.columns:
-                    inventory_brand_summary["Non RIS"] = 0
-                
-                # Reorder columns
-                column_order = ["Non RIS", "RIS", "Grand Total"]
-                inventory_brand_summary = inventory_brand_summary[[col for col in column_order if col in inventory_brand_summary.columns]]
-                
-                # Calculate Grand Total if it doesn't exist
-                if "Grand Total" not in inventory_brand_summary.columns:
-                    inventory_brand_summary["Grand Total"] = inventory_brand_summary.sum(axis=1)
+                inventory_brand_summary["Grand Total"] = inventory_brand_summary.sum(axis=1)
+                inventory_brand_summary.loc["Grand Total"] = inventory_brand_summary.sum()
                 
                 # Add percentage columns
                 inventory_brand_summary["Non RIS%"] = inventory_brand_summary["Non RIS"] / inventory_brand_summary["Grand Total"]
@@ -264,21 +341,35 @@ if original_file and fc_file and pm_file:
                 inventory_brand_summary[["Non RIS%", "RIS%"]] = inventory_brand_summary[["Non RIS%", "RIS%"]].fillna(0)
                 
                 # Brand-level summary
-                brand_summary = pd.pivot_table(
-                    Working,
-                    values="quantity-shipped",
-                    index=["Brand"],
-                    columns="RIS Status",
-                    aggfunc="sum",
-                    fill_value=0,
-                    margins=True,
-                    margins_name="Grand Total"
+                brand_summary = (
+                    Working.groupby(["Brand", "RIS Status"], observed=True)
+                    ["quantity-shipped"].sum()
+                    .unstack("RIS Status", fill_value=0)
+                    .reindex(columns=pd.Index(RIS_DTYPE.categories, name="RIS Status"), fill_value=0)
                 )
+                brand_summary["Grand Total"] = brand_summary.sum(axis=1)
+                brand_summary.loc["Grand Total"] = brand_summary.sum()
                 brand_summary["Non RIS%"] = brand_summary["Non RIS"] / brand_summary["Grand Total"]
                 brand_summary["RIS%"] = brand_summary["RIS"] / brand_summary["Grand Total"]
                 brand_summary[["Non RIS%", "RIS%"]] = brand_summary[["Non RIS%", "RIS%"]].fillna(0)
                 
+                # Keep results across reruns (tab switches, downloads)
+                st.session_state["upload_ids"] = upload_ids
+                st.session_state["working"] = Working
+                st.session_state["brand_summary"] = brand_summary
+                st.session_state["detailed"] = detailed_pivot_with_totals
+                st.session_state["inventory_brand_summary"] = inventory_brand_summary
+                st.session_state["inventory_detailed"] = inventory_pivot_with_totals
+                
             st.success("✅ Processing complete!")
+        
+        # Show the last results processed from these uploads
+        if st.session_state.get("upload_ids") == upload_ids:
+            Working = st.session_state["working"]
+            brand_summary = st.session_state["brand_summary"]
+            detailed_pivot_with_totals = st.session_state["detailed"]
+            inventory_brand_summary = st.session_state["inventory_brand_summary"]
+            inventory_pivot_with_totals = st.session_state["inventory_detailed"]
             
             # Create tabs for different analyses
             tab1, tab2 = st.tabs(["📊 State-Based RIS Analysis", "🏭 Amazon Inventory Placement Program"])
@@ -325,15 +416,17 @@ if original_file and fc_file and pm_file:
                     
                     return display_df
                 
+                # Format quantities in the grid instead of styling every cell
+                quantity_columns = {
+                    c: st.column_config.NumberColumn(format="%,d")
+                    for c in ("Non RIS", "RIS", "Grand Total")
+                }
+                
                 formatted_pivot = format_pivot_display(detailed_pivot_with_totals)
                 
-                # Simple styling without set_properties to avoid index conflicts
                 st.dataframe(
-                    formatted_pivot.style.format({
-                        "Non RIS": "{:,.0f}",
-                        "RIS": "{:,.0f}",
-                        "Grand Total": "{:,.0f}"
-                    }),
+                    formatted_pivot,
+                    column_config=quantity_columns,
                     use_container_width=True,
                     height=600
                 )
@@ -371,13 +464,9 @@ LOCAL_MAP = {
                 
                 formatted_inv_pivot = format_pivot_display(inventory_pivot_with_totals)
                 
-                # Simple styling without set_properties to avoid index conflicts
                 st.dataframe(
-                    formatted_inv_pivot.style.format({
-                        "Non RIS": "{:,.0f}",
-                        "RIS": "{:,.0f}",
-                        "Grand Total": "{:,.0f}"
-                    }),
+                    formatted_inv_pivot,
+                    column_config=quantity_columns,
                     use_container_width=True,
                     height=600
                 )
@@ -385,107 +474,41 @@ LOCAL_MAP = {
             # Download buttons
             st.subheader("📥 Download Results")
             
-            col1, col2, col3, col4 = st.columns(4)
+            # Raw processed data, written flat
+            processed_sheet = ('Processed Data', Working, False)
             
-            # Download processed data
-            with col1:
-                output = BytesIO()
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    Working.to_excel(writer, sheet_name='Processed Data', index=False)
-                output.seek(0)
-                st.download_button(
-                    label="📄 Processed Data",
-                    data=output,
-                    file_name="processed_data.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
-            
-            # Download state-based analysis
-            with col2:
-                output = BytesIO()
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    brand_summary.to_excel(writer, sheet_name='Brand Summary')
-                    detailed_pivot_with_totals.to_excel(writer, sheet_name='Detailed Analysis')
-                    
-                    # Format both sheets
-                    from openpyxl.styles import Font, PatternFill
-                    
-                    for sheet_name in ['Brand Summary', 'Detailed Analysis']:
-                        worksheet = writer.sheets[sheet_name]
-                        for row in worksheet.iter_rows(min_row=2):
-                            if row[1].value and "Total" in str(row[1].value):
-                                for cell in row:
-                                    cell.font = Font(bold=True)
-                                    cell.fill = PatternFill(start_color="E0E0E0", end_color="E0E0E0", fill_type="solid")
-                
-                output.seek(0)
-                st.download_button(
-                    label="📊 State-Based RIS",
-                    data=output,
-                    file_name="state_based_ris_analysis.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
+            report_sheets = [
+                # State-based analysis
+                ('State-Based Brand Summary', brand_summary, True),
+                ('State-Based Detailed', detailed_pivot_with_totals, True),
+                # Inventory placement analysis
+                ('Inventory Brand Summary', inventory_brand_summary, True),
+                ('Inventory Detailed', inventory_pivot_with_totals, True),
+                processed_sheet
+            ]
             
-            # Download inventory placement analysis
-            with col3:
-                output = BytesIO()
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    inventory_brand_summary.to_excel(writer, sheet_name='Brand Summary')
-                    inventory_pivot_with_totals.to_excel(writer, sheet_name='Detailed Analysis')
-                    
-                    # Format both sheets
-                    from openpyxl.styles import Font, PatternFill
-                    
-                    for sheet_name in ['Brand Summary', 'Detailed Analysis']:
-                        worksheet = writer.sheets[sheet_name]
-                        for row in worksheet.iter_rows(min_row=2):
-                            if row[1].value and "Total" in str(row[1].value):
-                                for cell in row:
-                                    cell.font = Font(bold=True)
-                                    cell.fill = PatternFill(start_color="E0E0E0", end_color="E0E0E0", fill_type="solid")
-                
-                output.seek(0)
-                st.download_button(
-                    label="🏭 Inventory Placement",
-                    data=output,
-                    file_name="inventory_placement_analysis.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
+            # One entry per download button: (label, file name, sheets)
+            downloads = [
+                ("📄 Processed Data", "processed_data.xlsx", [processed_sheet]),
+                ("📊 State-Based RIS", "state_based_ris_analysis.xlsx", [
+                    ('Brand Summary', brand_summary, True),
+                    ('Detailed Analysis', detailed_pivot_with_totals, True)
+                ]),
+                ("🏭 Inventory Placement", "inventory_placement_analysis.xlsx", [
+                    ('Brand Summary', inventory_brand_summary, True),
+                    ('Detailed Analysis', inventory_pivot_with_totals, True)
+                ]),
+                ("📦 Complete Report", "complete_ris_analysis_report.xlsx", report_sheets)
+            ]
             
-            # Download combined report
-            with col4:
-                output = BytesIO()
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    # State-based analysis
-                    brand_summary.to_excel(writer, sheet_name='State-Based Brand Summary')
-                    detailed_pivot_with_totals.to_excel(writer, sheet_name='State-Based Detailed')
-                    
-                    # Inventory placement analysis
-                    inventory_brand_summary.to_excel(writer, sheet_name='Inventory Brand Summary')
-                    inventory_pivot_with_totals.to_excel(writer, sheet_name='Inventory Detailed')
-                    
-                    # Raw processed data
-                    Working.to_excel(writer, sheet_name='Processed Data', index=False)
-                    
-                    # Format all sheets
-                    from openpyxl.styles import Font, PatternFill
-                    
-                    for sheet_name in writer.sheets:
-                        if sheet_name != 'Processed Data':
-                            worksheet = writer.sheets[sheet_name]
-                            for row in worksheet.iter_rows(min_row=2):
-                                if row[1].value and "Total" in str(row[1].value):
-                                    for cell in row:
-                                        cell.font = Font(bold=True)
-                                        cell.fill = PatternFill(start_color="E0E0E0", end_color="E0E0E0", fill_type="solid")
-                
-                output.seek(0)
-                st.download_button(
-                    label="📦 Complete Report",
-                    data=output,
-                    file_name="complete_ris_analysis_report.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
+            for col, (label, file_name, sheets) in zip(st.columns(4), downloads):
+                with col:
+                    st.download_button(
+                        label=label,
+                        data=build_report(sheets),
+                        file_name=file_name,
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                    )
             
     except Exception as e:
         st.error(f"❌ Error processing files: {str(e)}")